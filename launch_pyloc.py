@@ -1,17 +1,24 @@
 #! /usr/bin/env python
 
 __author__ = 'iped'
-import os
+import sys
+from pathlib import Path
 
-from traits.etsconfig.api import ETSConfig
-ETSConfig.toolkit = 'qt'
+from model.config import load_config
 
-from view.pyloc import PylocControl
-import yaml
+CONFIG_FILE = Path(__file__).resolve().parent / 'config.yml'
 
-if __name__ == '__main__':
-    config = None
-    with open(os.path.join(os.path.dirname(__file__), 'config.yml')) as f:
-        config = yaml.safe_load(f)
+
+def main():
+    try:
+        config = load_config(CONFIG_FILE)
+    except FileNotFoundError:
+        sys.exit("Config file {} not found".format(CONFIG_FILE))
+    # view.pyloc pulls in mayavi/VTK; only import it once the config is known to be good
+    from view.pyloc import PylocControl
     controller = PylocControl(config)
     controller.exec_()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+import copy
+import functools
+import os
+
+import yaml
+
+try:
+    from yaml import CSafeLoader as _Loader
+except ImportError:
+    from yaml import SafeLoader as _Loader
+
+
+@functools.lru_cache(maxsize=4)
+def _parse_config(path):
+    with open(path, 'rb') as f:
+        return yaml.load(f, Loader=_Loader)
+
+
+def load_config(path):
+    """
+    Loads a pyloc configuration file, parsing each file only once per process.
+    The widgets modify the config in place, so each caller gets its own copy.
+    :param path: Path to the YAML configuration file
+    :return: The configuration dict
+    """
+    return copy.deepcopy(_parse_config(os.path.abspath(path)))
@@ -1,4 +1,5 @@
 import csv
+import functools
 import logging
 # Where we have the "channel" column, this should be ChannelID. What we have right now is the "channel index" which is different.
 # Channel ID can be non-contiguous, and can have discontinuities.
@@ -28,7 +29,17 @@ GridId,  Template,          Location,           Hemisphere,  Label,  Channel,
 
 log = logging.getLogger()
 
+
+@functools.lru_cache(maxsize=256)
+def _expand_range(span):
+    # "a:b" -> (a, ..., b); the same spans repeat across rows and columns
+    start, end = span.split(':')
+    return tuple(range(int(start), int(end) + 1))
+
+
 class contact:
+    __slots__ = ('channelID', 'localChannelIdx', 'globalChannelIdx', 'contactType')
+
     def __init__(self):
         self.channelID = None # This is the unique channel identifier that is used to identify the channel in the raw data per Blackrock specifications.
         self.localChannelIdx = None # This is just the index of this channel in the electrode. Not unique.
@@ -36,6 +47,9 @@ class contact:
         self.contactType = None
 
 class electrode:
+    __slots__ = ('gridId', 'template', 'location', 'hemisphere', 'label',
+                 'numberOfChannels', 'channelIDs', 'contactsList')
+
     def __init__(self):
         self.gridId = None
         self.template = None
@@ -56,48 +70,47 @@ class GridMapParser:
 
     def parse(self):
         # Map files are really just CSV files with a header. We can use the csv module to parse them.
-        with open(self.filename, 'r') as file:
-            self.raw = file.read()
-        # Now we can parse the data
-        lines = self.raw.split('\n')
-        # Check if this is a channel ID file or a channel index file
-        header = lines[0].split(',')
-        if(header[5] == 'ChannelID'):
-            self.channelIDsPresent = True
-        for line in lines[1:]: # Skip the header
-            parts = line.split(',')
-            if len(parts) < 7:
-                log.debug("GridMapParser.parse: Skipping incomplete line")
-                continue
-            if(parts[2] == 'NoWhere'):
-                log.debug("GridMapParser.parse: Skipping dummy electrode")
-                continue # Skip the dummy electrode
-            log.debug(f"GridMapParser.parse: Parsing electrode {parts[4]}")
-            self.electrodeList.append(electrode())
-            self.electrodeList[-1].gridId = int(parts[0])
-            self.electrodeList[-1].template = parts[1]
-            self.electrodeList[-1].location = parts[2]
-            self.electrodeList[-1].hemisphere = parts[3]
-            self.electrodeList[-1].label = parts[4]
-            self.channelIDsPresent = True # for debug
-            if(self.channelIDsPresent):
-                electrodeChannelIDs = parts[5].split(':')
-                self.electrodeList[-1].channelIDs = list(range(int(electrodeChannelIDs[0]), int(electrodeChannelIDs[1]) + 1))  
-            # Now split the electrode per contact
-            self.electrodeList[-1].contactsList = []
-            contactRange = parts[6].split(':')
-            contactRange = list(range(int(contactRange[0]), int(contactRange[1]) + 1))
-            if(self.channelIDsPresent):
-                assert len(contactRange) == len(self.electrodeList[-1].channelIDs), "GridMapParser.parse: Channel ID and contact range mismatch" 
-            for loopIdx, contactIdx in enumerate(contactRange):
-                self.contactTotal += 1
-                self.electrodeList[-1].numberOfChannels += 1
-                self.electrodeList[-1].contactsList.append(contact())
+        # Rows are read straight off the file; columns are padded with spaces after the commas.
+        # utf-8-sig drops the byte order mark that Excel writes in front of the first header cell
+        with open(self.filename, 'r', newline='', encoding='utf-8-sig') as file:
+            reader = csv.reader(file, skipinitialspace=True)
+            header = next(reader, [])
+            # Columns are positional: GridId, Template, Location, Hemisphere, Label, Channel(ID), GridElectrode
+            # Check if this is a channel ID file or a channel index file
+            if len(header) > 5 and header[5].strip() == 'ChannelID':
+                self.channelIDsPresent = True
+            for parts in reader:
+                if len(parts) < 7:
+                    log.debug("GridMapParser.parse: Skipping incomplete line")
+                    continue
+                if(parts[2] == 'NoWhere'):
+                    log.debug("GridMapParser.parse: Skipping dummy electrode")
+                    continue # Skip the dummy electrode
+                log.debug("GridMapParser.parse: Parsing electrode %s", parts[4])
+                e = electrode()
+                e.gridId = int(parts[0])
+                e.template = parts[1]
+                e.location = parts[2]
+                e.hemisphere = parts[3]
+                e.label = parts[4]
+                self.electrodeList.append(e)
+                self.channelIDsPresent = True # for debug
+                if(self.channelIDsPresent):
+                    e.channelIDs = list(_expand_range(parts[5]))
+                # Now split the electrode per contact
+                e.contactsList = []
+                contactRange = _expand_range(parts[6])
                 if(self.channelIDsPresent):
-                    self.electrodeList[-1].contactsList[-1].channelID = self.electrodeList[-1].channelIDs[loopIdx]
-                self.electrodeList[-1].contactsList[-1].localChannelIdx = loopIdx
-                self.electrodeList[-1].contactsList[-1].globalChannelIdx = self.contactTotal
-                self.electrodeList[-1].contactsList[-1].contactType = self.electrodeList[-1].template
-            log.debug(f"GridMapParser.parse: Parsed {len(self.electrodeList[-1].contactsList)} contacts for electrode {self.electrodeList[-1].label}")
-            log.debug("GridMapParser.parse: Parsed electrode {self.electrodeList[-1].label} with {len(self.electrodeList[-1].contactsList)} contacts")
-        log.debug(f"GridMapParser.parse: Parsed {len(self.electrodeList)} electrodes with {self.contactTotal} contacts")
\ No newline at end of file
+                    assert len(contactRange) == len(e.channelIDs), "GridMapParser.parse: Channel ID and contact range mismatch"
+                for loopIdx, contactIdx in enumerate(contactRange):
+                    self.contactTotal += 1
+                    e.numberOfChannels += 1
+                    c = contact()
+                    if(self.channelIDsPresent):
+                        c.channelID = e.channelIDs[loopIdx]
+                    c.localChannelIdx = loopIdx
+                    c.globalChannelIdx = self.contactTotal
+                    c.contactType = e.template
+                    e.contactsList.append(c)
+                log.debug("GridMapParser.parse: Parsed %s contacts for electrode %s", len(e.contactsList), e.label)
+        log.debug("GridMapParser.parse: Parsed %s electrodes with %s contacts", len(self.electrodeList), self.contactTotal)
\ No newline at end of file
@@ -13,7 +13,6 @@ __status__ = "Development"
 
 import math
 
-import nibabel as nib
 import numpy as np
 import numpy.linalg
 import numpy.matlib
@@ -374,6 +373,7 @@ def interpol_grid_to_mask(coor1, coor2, coor3, m, n, mask):
         for k in warped_elec_coor:
             tmp[int(k[0]), int(k[1]), int(k[2])] = 2
         if np.mod(iter_i, 5) == 0:
+            import nibabel as nib
             nib.save(nib.Nifti1Image(tmp, np.eye(4)), '/Users/lkini/Documents/LittLab/Data/tmp/tmp_%i.nii.gz' % iter_i)
         iter_i += 1
 
@@ -1,5 +1,5 @@
-import nibabel as nib
 import numpy as np
+import scipy.spatial
 from traits.api import HasTraits , CArray, Instance,on_trait_change
 from collections import OrderedDict
 import logging
@@ -27,6 +27,7 @@ class PointCloud(HasTraits):
 
     def __init__(self, coordinates):
         super(PointCloud, self).__init__()
+        self._kdtree = None
         self.coordinates = np.array(coordinates)
 
     def __len__(self):
@@ -36,7 +37,7 @@ class PointCloud(HasTraits):
         return self.coordinates.mean(0)
 
     def clear(self):
-        self.coordinates = np.array([[], [], []]).T
+        self.coordinates = np.empty((0, 3), np.int16)
 
     def set_coordinates(self, coordinates):
         self.coordinates = np.array(coordinates)
@@ -47,6 +48,26 @@ class PointCloud(HasTraits):
         else:
             return self.coordinates[mask]
 
+    def _coordinates_changed(self):
+        self._kdtree = None
+
+    def within(self, point, distance):
+        """
+        Finds the points strictly closer than distance to point.
+        The KD-tree is built on first use and kept until the coordinates change.
+        :return: boolean mask over the coordinates
+        """
+        point = np.asarray(point, float)
+        mask = np.zeros(len(self), bool)
+        if len(self) == 0 or np.isnan(point).any():
+            return mask
+        if self._kdtree is None:
+            self._kdtree = scipy.spatial.cKDTree(self.coordinates)
+        candidates = np.array(self._kdtree.query_ball_point(point, distance), int)
+        sq_dists = np.sum(np.square(self.coordinates[candidates] - point), 1)
+        mask[candidates[sq_dists < distance ** 2]] = True
+        return mask
+
 
 class PointMask(HasTraits):
 
@@ -73,6 +94,10 @@ class PointMask(HasTraits):
         for coordinate in coordinates:
             self.mask[all_coordinates == coordinate] = True
 
+    def set_mask(self, point_mask):
+        self.mask = point_mask.mask.astype(bool)
+        self._bounds = self._calculate_bounds()
+
     def add_mask(self, point_mask):
         self.mask = np.logical_or(self.mask, point_mask.mask)
         self._bounds = self._calculate_bounds()
@@ -84,7 +109,7 @@ class PointMask(HasTraits):
         self.mask = np.logical_and(self.mask, to_keep)
         after = np.count_nonzero(self.mask)
 
-        log.debug("Removing {} points".format(after - before))
+        log.debug("Removing %s points", after - before)
         self._bounds = self._calculate_bounds()
 
     def coordinates(self):
@@ -102,18 +127,17 @@ class PointMask(HasTraits):
 
     @staticmethod
     def combined(point_masks):
-        indices = np.array([])
-        coords = np.array([[], [], []]).T
+        indices = np.array([], int)
+        coords = [np.array([[], [], []]).T]
         labels = []
         for mask in point_masks:
-            mask_indices = np.where(mask.mask)[0]
-            new_indices = mask_indices[np.logical_not(np.in1d(mask_indices, indices, True))]
+            mask_indices = np.flatnonzero(mask.mask)
+            new_indices = mask_indices[np.logical_not(np.isin(mask_indices, indices, assume_unique=True))]
             if len(new_indices) > 0:
-                new_coords = np.array([mask.point_cloud.get_coordinates()[i, :] for i in new_indices])
-                coords = np.concatenate([coords, new_coords], 0)
-                labels.extend([mask.label for _ in new_indices])
+                coords.append(mask.point_cloud.get_coordinates()[new_indices])
+                labels.extend([mask.label] * len(new_indices))
                 indices = np.union1d(indices, new_indices)
-        return coords, labels
+        return np.concatenate(coords, 0), labels
 
     def _calculate_bounds(self):
         if len(self.point_cloud) == 0 or not self.mask.any():
@@ -136,9 +160,7 @@ class PointMask(HasTraits):
 
     @staticmethod
     def proximity_mask(point_cloud, point, distance):
-        vector_dist = point_cloud.get_coordinates() - point
-        dists = np.sqrt(np.sum(np.square(vector_dist), 1))
-        return PointMask('_proximity', point_cloud, dists < distance)
+        return PointMask('_proximity', point_cloud, point_cloud.within(point, distance))
 
     @staticmethod
     def centered_proximity_mask(point_cloud, point, distance):
@@ -146,12 +168,11 @@ class PointMask(HasTraits):
 
         attempts = 0
         for _ in range(4):
-            log.debug("Center attempt {}".format(attempts))
-            vector_dist = coordinates - point
-            dists = np.sqrt(np.sum(np.square(vector_dist), 1))
-            point = np.mean(coordinates[dists < distance, :], 0)
+            log.debug("Center attempt %s", attempts)
+            in_range = point_cloud.within(point, distance)
+            point = np.mean(coordinates[in_range, :], 0)
             attempts += 1
-        return PointMask('_proximity', point_cloud, dists < distance)
+        return PointMask('_proximity', point_cloud, in_range)
 
     def get_center(self):
         return np.mean(self.coordinates(), 0)
@@ -222,15 +243,15 @@ class Lead(object):
     def seed_next_contact(self, centered_coordinate):
 
         if self.has_coordinate(centered_coordinate):
-            log.debug("Coordinate {} is already assigned".format(centered_coordinate))
+            log.debug("Coordinate %s is already assigned", centered_coordinate)
             return
 
         if len(self.contacts) == 0:
             new_mask = PointMask.centered_proximity_mask(self.point_cloud, centered_coordinate, self.radius)
             if not new_mask.mask.any():
-                log.debug("Could not find an electrode at {}".format(centered_coordinate))
+                log.debug("Could not find an electrode at %s", centered_coordinate)
                 return
-            log.debug("Added first contact to {}".format(self.label))
+            log.debug("Added first contact to %s", self.label)
             self.add_contact(new_mask, *self._next_contact_info())
             return
 
@@ -238,7 +259,7 @@ class Lead(object):
 
         new_mask = PointMask.centered_proximity_mask(self.point_cloud, centered_coordinate, self.radius)
         if not new_mask.mask.any():
-            log.debug("Could not find an electrode at {}".format(centered_coordinate))
+            log.debug("Could not find an electrode at %s", centered_coordinate)
             return
         next_info = self._next_contact_info()
         if next_info[0] != last_contact.label:
@@ -321,7 +342,7 @@ class Lead(object):
 
         diffs = np.diff(present.astype(int), axis=1)
 
-        log.debug("Lead diffs 1 = {}".format(diffs))
+        log.debug("Lead diffs 1 = %s", diffs)
 
         holes = []
 
@@ -339,7 +360,7 @@ class Lead(object):
 
         diffs = np.diff(present.astype(int), axis=0)
 
-        log.debug("Lead diffs 0 = {}".format(diffs))
+        log.debug("Lead diffs 0 = %s", diffs)
 
         holes = []
 
@@ -369,7 +390,7 @@ class Lead(object):
 
         diffs = np.diff(present.astype(int))
 
-        log.debug("Lead diffs = {}".format(diffs))
+        log.debug("Lead diffs = %s", diffs)
 
         if not any(diffs == -1) or not any(diffs == 1):
             log.info("No holes present. Nothing to interpolate")
@@ -386,7 +407,7 @@ class Lead(object):
 
     def _interpolate_between_1d(self, contact_1, contact_2, increment):
 
-        log.debug("Interpolating between {} and {}".format(contact_1.label, contact_2.label))
+        log.debug("Interpolating between %s and %s", contact_1.label, contact_2.label)
 
         start_label = contact_1.label
         start_num = ''.join(re.findall(r'\d+', start_label))
@@ -418,7 +439,7 @@ class Lead(object):
                 grid_coordinate = [loc, contact_1.lead_location[dim] + i]
             mask = PointMask.centered_proximity_mask(self.point_cloud, point, self.radius)
             if not mask.mask.any():
-                log.info("Could not find any points near {}".format(point))
+                log.info("Could not find any points near %s", point)
                 continue
             center = mask.get_center()
 
@@ -427,8 +448,8 @@ class Lead(object):
             do_skip = False
             for existing_center in centers:
                 if all(abs(existing_center - center) < .5):
-                    log.warning("Contact {} determined to have same center as previously defined contact."
-                                " Skipping".format(new_label))
+                    log.warning("Contact %s determined to have same center as previously defined contact."
+                                " Skipping", new_label)
                     do_skip = True
                     break
             if do_skip:
@@ -436,7 +457,7 @@ class Lead(object):
             centers.append(center)
 
             self.add_contact(mask, new_label, grid_coordinate, contact_1.lead_group)
-            log.info("Added contact {} at {}".format(new_label, point))
+            log.info("Added contact %s at %s", new_label, point)
 
     def make_micro_contacts(self):
         # All this only works for depth electrodes
@@ -486,7 +507,7 @@ class Lead(object):
         if contact_label in self.contacts:
             self.remove_contact(contact_label)
         if self.has_coordinate(point_mask.get_center()):
-            log.warning("Coordinates {} of {}{} already exist.".format(point_mask.get_center(), self.label, contact_label))
+            log.warning("Coordinates %s of %s%s already exist.", point_mask.get_center(), self.label, contact_label)
         self.contacts[contact_label] = contact
         self.last_contact = contact
 
@@ -554,15 +575,18 @@ class CT(object):
 
     def _load_scan(self, img_file):
         self.filename = img_file
-        log.debug("Loading {}".format(img_file))
+        log.debug("Loading %s", img_file)
+        # nibabel is only needed once a scan is opened, so it is kept off the startup path
+        import nibabel as nib
         img = nib.load(self.filename)
-        x = img.get_fdata()
+        x = img.get_fdata(dtype=np.float32)
         self.data = x.squeeze()
         self.originalData = x.squeeze()
-        self.brainmask = np.zeros(img.get_fdata().shape, bool)
+        self.brainmask = np.zeros(x.shape, bool)
         self.affine = img.affine[:3,:]
 
     def add_mask(self, filename):
+        import nibabel as nib
         mask = nib.load(filename).get_fdata()
         self.brainmask = mask
 
@@ -700,16 +724,23 @@ class CT(object):
         self.from_dict(json.load(open(filename)))
 
     def set_leads(self, labels, lead_types, dimensions, radii, spacings,micros=None):
-        for label in self._leads.keys():
-            if label not in labels:
-                del self._leads[label]
+        """
+        Adds leads that are not defined yet and removes the ones not in labels. Existing leads are kept as they are.
+        :return: The labels of the added leads and the labels of the removed leads
+        """
+        removed = [label for label in self._leads if label not in labels]
+        for label in removed:
+            del self._leads[label]
         if micros is None:
             micros = [self.config['micros'][' None'] for l in labels]
+        added = []
         for label, lead_type, dimension, radius, spacing,micro in zip(
                 labels, lead_types, dimensions, radii, spacings,micros):
             if label not in self._leads:
-                log.debug("Adding lead {}, ({} {} {})".format(label, lead_type, dimension, spacing))
+                log.debug("Adding lead %s, (%s %s %s)", label, lead_type, dimension, spacing)
                 self._leads[label] = Lead(self._points, label, lead_type, dimension, radius, spacing,micro)
+                added.append(label)
+        return added, removed
 
     def get_lead(self, lead_name):
         return self._leads[lead_name]
@@ -726,24 +757,25 @@ class CT(object):
         return self.data.shape
 
     def set_threshold(self, threshold):
-        logging.debug("Threshold is set to {} percentile".format(threshold))
+        log.debug("Threshold is set to %s percentile", threshold)
         self.threshold = threshold
         if self.data is None:
             raise PylocModelException("Data is not loaded")
         threshold_value = np.percentile(self.data, self.threshold)
-        logging.debug("Thresholding at an intensity of {}".format(threshold_value))
-        mask = self.originalData >= threshold_value
-        logging.debug("Getting super-threshold indices")
-        indices = np.array(mask.nonzero()).T
-        logging.debug("Setting coordinates")        
+        log.debug("Thresholding at an intensity of %s", threshold_value)
+        log.debug("Getting super-threshold indices")
+        # Voxel indices are small non-negative integers; int16 keeps the cloud a quarter the size of int64.
+        # Building from the flat indices gives a contiguous (N, 3) array rather than a transposed view
+        flat_indices = np.flatnonzero(self.originalData >= threshold_value)
+        indices = np.stack(np.unravel_index(flat_indices, self.originalData.shape), 1).astype(np.int16)
+        log.debug("Setting coordinates")        
         self._points.set_coordinates(indices)
-        logging.debug("Setting _selection")
+        log.debug("Setting _selection")
         self._selection = PointMask("_selection", self._points)
-        logging.debug("Done setting threshold")
+        log.debug("Done setting threshold")
 
     def select_points(self, point_mask):
-        self._selection.clear()
-        self._selection.add_mask(point_mask)
+        self._selection.set_mask(point_mask)
 
     def select_points_near(self, point, nearby_range=10):
         self.select_points(PointMask.proximity_mask(self._points, point, nearby_range))
@@ -751,6 +783,24 @@ class CT(object):
     def selection_center(self):
         return self._selection.get_center()
 
+    def recenter_selection(self, radius, iterations):
+        """
+        Repeatedly reselects the points near the center of the current selection.
+        Intermediate selections are kept as plain masks; only the final one is stored.
+        :param radius: Distance from the center within which points are selected
+        :param iterations: Number of times to recenter
+        :return: The center the final selection was made around, or None if iterations is 0
+        """
+        coordinates = self._points.get_coordinates()
+        mask = self._selection.mask
+        center = None
+        for _ in range(iterations):
+            center = np.mean(coordinates[mask], 0)
+            mask = self._points.within(center, radius)
+        if center is not None:
+            self.select_points(PointMask('_proximity', self._points, mask))
+        return center
+
     def select_weighted_center(self, point, radius=10, iterations=1):
         self.select_points_near(point, radius)
         for _ in range(iterations):
@@ -810,7 +860,7 @@ class CT(object):
             self.coordSystem = 'LAS'
         else:
             self.coordSystem = 'RAS'
-        logging.debug("Switching coordinate system to " + self.coordSystem)
+        log.debug("Switching coordinate system to %s", self.coordSystem)
         self._points.coordinates = np.array([self.shape[0] - self._points.coordinates[:, 0],
                                              self._points.coordinates[:, 1],
                                              self._points.coordinates[:, 2]]).T
@@ -1,9 +1,10 @@
 import os
-from traits.etsconfig.api import ETSConfig
-ETSConfig.toolkit = 'qt'
+# ETSConfig reads this when the toolkit is first needed; must be set before pyface is imported
+os.environ.setdefault('ETS_TOOLKIT', 'qt')
 
 from pyface.qt import QtGui, QtCore
-from model.scan import CT
+from model.config import load_config
+from model.scan import CT, MicroContact
 from view.slice_viewer import SliceViewWidget
 from mayavi.core.ui.api import MayaviScene, MlabSceneModel, \
     SceneEditor
@@ -11,16 +12,29 @@ from mayavi import mlab
 from traits.api import HasTraits, Instance, on_trait_change
 from traitsui.api import View, Item
 
+import functools
 import random
 import numpy as np
 import logging
-import yaml
 import re
 
 from collections import OrderedDict
 
 log = logging.getLogger()
-log.setLevel(1)
+
+_DIGITS_RE = re.compile(r"\d+")
+
+
+@functools.lru_cache(maxsize=1024)
+def _contact_sort_key(contact_label):
+    # The same labels are sorted again on every refresh of the contact list
+    return int(''.join(_DIGITS_RE.findall(contact_label)))
+
+
+@functools.lru_cache(maxsize=None)
+def _lead_shade(lead_label):
+    # Seeding the generator is the costly part, and the value only depends on the label
+    return random.Random(lead_label).random()
 
 
 def add_labeled_widget(layout, label, *widgets):
@@ -32,6 +46,21 @@ def add_labeled_widget(layout, label, *widgets):
     layout.addLayout(sub_layout)
 
 
+def set_list_texts(list_widget, texts):
+    """
+    Makes a QListWidget show the given rows, reusing its existing items.
+    Only rows whose text differs are rewritten; items are only added or removed at the end of the list.
+    :param list_widget: The QListWidget to update
+    :param texts: The text of each row, in order
+    """
+    for row in range(min(len(texts), list_widget.count())):
+        item = list_widget.item(row)
+        if item.text() != texts[row]:
+            item.setText(texts[row])
+    while list_widget.count() > len(texts):
+        list_widget.takeItem(list_widget.count() - 1)
+    list_widget.addItems(texts[list_widget.count():])
+
 
 class PylocControl(object):
     """
@@ -40,9 +69,9 @@ class PylocControl(object):
     def __init__(self, config=None):
         log.debug("Initializing PylocControl")
         if config == None:
-            config = yaml.load(open("../model/config.yml"))
+            config = load_config(os.path.join(os.path.dirname(__file__), "../config.yml"))
 
-        log.debug("Config: {}".format(config))
+        log.debug("Config: %s", config)
         log.debug("Starting application")
         self.app = QtGui.QApplication.instance() #: The underlying application. Runs automatically
         self.view = PylocWidget(self, config) #: The base object for the GUI
@@ -64,8 +93,8 @@ class PylocControl(object):
         self.assign_callbacks()
         self.assign_shortcuts()
 
-        self.clicked_coordinate = np.zeros((3,))
-        self.selected_coordinate = np.zeros((3,))
+        self.clicked_coordinate = np.zeros(3, np.float32)
+        self.selected_coordinate = np.zeros(3, np.float32)
 
         self.selected_lead = None #: The lead currently being localized
         self.contact_label = ""
@@ -113,14 +142,14 @@ class PylocControl(object):
         else:
             log.debug("Seeding disabled")
             self.view.display_message("")
-        log.debug("Seeding toggled, seeding is now {}".format(self.seeding))
+        log.debug("Seeding toggled, seeding is now %s", self.seeding)
 
     def display_seed_contact(self):
         log.debug("Displaying seed contact")
         next_label = self.selected_lead.next_contact_label()
-        log.debug("Next label: {}".format(next_label))
+        log.debug("Next label: %s", next_label)
         next_loc = self.selected_lead.next_contact_loc()
-        log.debug("Next location: {}".format(next_loc))
+        log.debug("Next location: %s", next_loc)
 
         log.debug("Updating view with message...")
         msg = "Click on contact {}{} ({}, {})".format(self.selected_lead.label, next_label, *next_loc)
@@ -128,31 +157,31 @@ class PylocControl(object):
         log.debug("View updated with message, display_seed_contact complete.")
 
     def set_lead_location(self, lead_location, lead_group):
-        log.debug("Setting lead location to {} and group to {}".format(lead_location, lead_group))
+        log.debug("Setting lead location to %s and group to %s", lead_location, lead_group)
         self.lead_location = lead_location
         self.lead_group = lead_group
-        log.debug("Lead location set to {} and group to {}, set_lead_location done".format(lead_location, lead_group))
+        log.debug("Lead location set to %s and group to %s, set_lead_location done", lead_location, lead_group)
 
     def set_contact_label(self, label):
-        log.debug("Setting contact label to {}".format(label))
+        log.debug("Setting contact label to %s", label)
         self.contact_label = label
         self.lead_group = 0
-        log.debug("Contact label set to {}, set_contact_label done".format(label))
+        log.debug("Contact label set to %s, set_contact_label done", label)
 
     def set_selected_lead(self, lead_name):
-        log.debug("Setting selected lead to {}".format(lead_name))
+        log.debug("Setting selected lead to %s", lead_name)
         try:
-            log.debug("Getting lead {}".format(lead_name))
+            log.debug("Getting lead %s", lead_name)
             self.selected_lead = self.ct.get_lead(lead_name)
             log.debug("Updating lead dimensions in contact panel...")
             dims = self.selected_lead.dimensions
-            log.debug("Lead dimensions: {}".format(dims))
+            log.debug("Lead dimensions: %s", dims)
             self.view.contact_panel.update_lead_dims(*dims)
             log.debug("Lead dimensions updated")
         except KeyError:
-            log.error("Lead {} does not exist".format(lead_name))
+            log.error("Lead %s does not exist", lead_name)
         self.select_next_contact_label()
-        log.debug("Selected lead set to {}, set_selected_lead done".format(lead_name))
+        log.debug("Selected lead set to %s, set_selected_lead done", lead_name)
 
     def toggle_RAS_axes(self,state):
         log.debug("Toggling RAS axes")
@@ -166,7 +195,7 @@ class PylocControl(object):
         log.debug("Prompting for CT")
         (file_, filter_) = QtGui.QFileDialog().getOpenFileName(None, 'Select Scan', '.', '(*)')
         if file_:
-            log.debug("Loading CT from file {}".format(file_))
+            log.debug("Loading CT from file %s", file_)
             self.load_ct(filename=file_)
             self.view.task_bar.define_leads_button.setEnabled(True)
             self.view.task_bar.save_button.setEnabled(True)
@@ -181,7 +210,7 @@ class PylocControl(object):
         :param filename: The name of the CT file.
         :return:
         """
-        log.debug("Loading CT from file {}".format(filename))
+        log.debug("Loading CT from file %s", filename)
         self.ct = CT(self.config)
         log.debug("Loading CT...")
         self.ct.load(filename,self.config['ct_threshold'])
@@ -227,11 +256,20 @@ class PylocControl(object):
         :return:
         """
         log.debug("Assigning shortcuts")
-        QtGui.QShortcut(QtGui.QKeySequence('S'),self.view).activated.connect(self.add_selection)
-        QtGui.QShortcut(QtGui.QKeySequence('Ctrl+O'),self.view).activated.connect(self.prompt_for_ct)
-        QtGui.QShortcut(QtGui.QKeySequence('Ctrl+Shift+O'),self.view).activated.connect(self.load_coordinates)
-        QtGui.QShortcut(QtGui.QKeySequence('Ctrl+D'),self.view).activated.connect(self.define_leads)
-        QtGui.QShortcut(QtGui.QKeySequence('Ctrl+S'),self.view).activated.connect(self.save_coordinates)
+        shortcuts = (
+            ('S', self.add_selection),
+            ('Ctrl+O', self.prompt_for_ct),
+            ('Ctrl+Shift+O', self.load_coordinates),
+            ('Ctrl+D', self.define_leads),
+            ('Ctrl+S', self.save_coordinates),
+        )
+        # Actions on the main window keep the window shortcut context the QShortcuts had,
+        # so 'S' still does not fire in the lead definition window
+        for key, callback in shortcuts:
+            action = QtGui.QAction(self.window)
+            action.setShortcut(QtGui.QKeySequence(key))
+            action.triggered.connect(callback)
+            self.window.addAction(action)
 
     def save_coordinates(self):
         """
@@ -242,18 +280,18 @@ class PylocControl(object):
         file,file_filter = QtGui.QFileDialog().getSaveFileName(None,'Save as:',os.path.join(os.getcwd(),'voxel_coordinates.txt'),
                                                             'JSON (*.json);;TXT (*.txt)','JSON (*.json)')
         if file:
-            log.debug("Saving to file {}".format(file))
+            log.debug("Saving to file %s", file)
             self.ct.saveas(file,os.path.splitext(file)[-1],self.view.task_bar.bipolar_box.isChecked())
-            log.debug("Saved to file {}".format(file))
+            log.debug("Saved to file %s", file)
         log.debug("Save coordinates done.")
 
     def load_coordinates(self):
         log.debug("Loading coordinates")
         (file, filter) = QtGui.QFileDialog().getOpenFileName(None, 'Select voxel_coordinates.json', '.', '(*.json)')
         if file:
-            log.debug("Loading from file {}".format(file))
+            log.debug("Loading from file %s", file)
             self.ct.from_json(file)
-            log.debug("Loaded from file {}".format(file))
+            log.debug("Loaded from file %s", file)
             log.debug("Updating view, and adding _leads cloud...")
             self.view.update_cloud('_leads')
             log.debug("_leads clouds updated, updating contact panel...")
@@ -264,9 +302,9 @@ class PylocControl(object):
         log.debug("Loading gridmap file")
         (file, filter) = QtGui.QFileDialog().getOpenFileName(None, 'Select gridmap file', '.', '(*)')
         if file:
-            log.debug("Loading from file {}".format(file))
+            log.debug("Loading from file %s", file)
             self.ct.load_gridmap(file)
-            log.debug("Loaded from file {}".format(file))
+            log.debug("Loaded from file %s", file)
             log.debug("Updating view, and adding _leads cloud...")
             self.view.update_cloud('_leads')
             log.debug("_leads clouds updated, updating contact panel...")
@@ -299,36 +337,36 @@ class PylocControl(object):
         :param allow_seed: ???
         :return:
         """
-        log.debug("select_coordinate: Selecting near coordinate {}".format(coordinate))
+        log.debug("select_coordinate: Selecting near coordinate %s", coordinate)
+        coordinate = np.asarray(coordinate, np.float32)
         self.clicked_coordinate = coordinate
         self.selected_coordinate = coordinate
         radius = self.selected_lead.radius if not self.selected_lead is None else 5
-        log.debug("Selecting points near coordinate {} with radius {}".format(coordinate, radius))
+        log.debug("Selecting points near coordinate %s with radius %s", coordinate, radius)
         self.ct.select_points_near(coordinate, radius)
         if do_center:
             log.debug("Centering selection")
             self.center_selection(self.config['selection_iterations'], radius)
         log.debug("Updating view...")
         panel = self.view.contact_panel
-        for i, (_,contact) in enumerate(panel.contacts):
-            if self.clicked_coordinate in contact:
-                log.debug("Setting current row in contact list to {}".format(i))
-                panel.contact_list.setCurrentRow(i)
-                break
+        i = panel.contact_index(self.clicked_coordinate)
+        if i is not None:
+            log.debug("Setting current row in contact list to %s", i)
+            panel.contact_list.setCurrentRow(i)
         else:
             log.debug("No contact found")
             panel.contact_list.setCurrentRow(panel.contact_list.currentRow(),QtGui.QItemSelectionModel.Deselect)
 
         if not np.isnan(self.selected_coordinate).all():
             if self.seeding and allow_seed:
-                log.debug("Seeding from coordinate {}".format(self.selected_coordinate))
-                log.info("Seeding from coordinate {}".format(self.selected_coordinate))
+                log.debug("Seeding from coordinate %s", self.selected_coordinate)
+                log.info("Seeding from coordinate %s", self.selected_coordinate)
                 self.selected_lead.seed_next_contact(self.selected_coordinate)
                 log.debug("Seeding done, updating view...")
                 self.ct.clear_selection()
                 log.debug("Clearing selection")
                 log.debug("Updating view...")
-                self.selected_coordinate = np.zeros((3,))
+                self.selected_coordinate = np.zeros(3, np.float32)
                 log.debug
                 self.view.update_cloud('_leads')
                 self.select_next_contact_label()
@@ -336,16 +374,16 @@ class PylocControl(object):
                 self.display_seed_contact()
             else:
                 self.view.update_ras(self.selected_coordinate)
-                log.info("Selected coordinate {}".format(self.selected_coordinate))
+                log.info("Selected coordinate %s", self.selected_coordinate)
         else:
             log.info("No coordinate selected")
         self.view.update_cloud('_selected')
         self.view.update_slices(self.selected_coordinate)
 
     def center_selection(self, iterations, radius):
-        for _ in range(iterations):
-            self.selected_coordinate = self.ct.selection_center()
-            self.ct.select_points_near(self.selected_coordinate, radius)
+        center = self.ct.recenter_selection(radius, iterations)
+        if center is not None:
+            self.selected_coordinate = center.astype(np.float32)
 
     def confirm(self, label):
         reply = QtGui.QMessageBox.question(None, 'Confirmation', label,
@@ -398,11 +436,10 @@ class PylocControl(object):
         self.view.update_contact_label(self.contact_label)
 
     def set_leads(self, labels, lead_types, dimensions, radii, spacings,micros=None):
-        self.ct.set_leads(labels, lead_types, dimensions, radii, spacings,micros)
-        leads = self.ct.get_leads()
-        panel_labels = ['%s (%s x %s)' % (k, v.dimensions[0], v.dimensions[1]) for (k, v) in leads.items()]
-        self.view.contact_panel.set_lead_labels(panel_labels)
-        self.view.contact_panel.update_contacts()
+        added, removed = self.ct.set_leads(labels, lead_types, dimensions, radii, spacings,micros)
+        if added or removed:
+            # Also refreshes the lead dropdown
+            self.view.contact_panel.update_contacts()
 
     def delete_contact(self, lead_label, contact_label):
         try:
@@ -441,6 +478,9 @@ class PylocWidget(QtGui.QWidget):
         layout.addWidget(splitter)
         layout.addLayout(self.task_bar)
 
+        # Labels of clouds waiting to be redrawn, in the order they were first marked
+        self._dirty_clouds = {}
+
     def clear(self):
         pass
 
@@ -448,7 +488,18 @@ class PylocWidget(QtGui.QWidget):
         self.cloud_widget.display_message(msg)
 
     def update_cloud(self, label):
-        self.cloud_widget.update_cloud(label)
+        """
+        Marks a cloud for redrawing. Clouds are redrawn once the current event has been handled,
+        so several updates to the same cloud in one callback only rebuild it once.
+        """
+        if not self._dirty_clouds:
+            QtCore.QTimer.singleShot(0, self._flush_clouds)
+        self._dirty_clouds[label] = None
+
+    def _flush_clouds(self):
+        labels = list(self._dirty_clouds)
+        self._dirty_clouds.clear()
+        self.cloud_widget.update_clouds(labels)
 
     def update_clouds(self):
         self.cloud_widget.viewer.update_all()
@@ -461,7 +512,7 @@ class PylocWidget(QtGui.QWidget):
         self.cloud_widget.plot_cloud(label)
 
     def add_cloud(self, ct, label, callback=None):
-        log.debug("PylocWidget.add_cloud: Adding cloud {} to view".format(label))
+        log.debug("PylocWidget.add_cloud: Adding cloud %s to view", label)
         self.cloud_widget.add_cloud(ct, label, callback)
 
     def add_RAS(self,ct,callback=None):
@@ -574,8 +625,11 @@ class ContactPanelWidget(QtGui.QWidget):
         layout.addWidget(contact_label)
 
         self.contacts = []
+        self._contact_bounds = None
         self.contact_list = QtGui.QListWidget()
         self.contact_list.setSelectionMode(QtGui.QAbstractItemView.ContiguousSelection)
+        # Every row is one line of text; lets the view lay out rows without measuring each one
+        self.contact_list.setUniformItemSizes(True)
         layout.addWidget(self.contact_list)
 
         self.interpolate_button = QtGui.QPushButton("Interpolate")
@@ -608,7 +662,7 @@ class ContactPanelWidget(QtGui.QWidget):
         self.micro_button.clicked.connect(self.controller.add_micro_contacts)
         self.axes_checkbox.stateChanged.connect(self.controller.toggle_RAS_axes)
 
-    LEAD_LOC_REGEX = r'\((\d+\.?\d*),\s?(\d+\.?\d*),\s?(\d+\.?\d*)\)'
+    LEAD_LOC_REGEX = re.compile(r'\((\d+\.?\d*),\s?(\d+\.?\d*),\s?(\d+\.?\d*)\)')
 
     def keyPressEvent(self, event):
         super(ContactPanelWidget, self).keyPressEvent(event)
@@ -617,51 +671,65 @@ class ContactPanelWidget(QtGui.QWidget):
             items  = [self.contacts[i.row()] for i in indices ]
             for (lead,contact) in items:
                 try:
-                    log.debug("Deleting contact {}{}".format(lead.label, contact.label))
+                    log.debug("Deleting contact %s%s", lead.label, contact.label)
                     self.controller.delete_contact(lead.label, contact.label)
                 except Exception as e:
-                    log.error("Could not delete contact: {}".format(e))
+                    log.error("Could not delete contact: %s", e)
             self.update_contacts()
 
     def chosen_lead_selected(self):
         current_index = self.contact_list.currentIndex()
         _, current_contact = self.contacts[current_index.row()]
-        log.debug("Selecting contact {}".format(current_contact.label))
+        log.debug("Selecting contact %s", current_contact.label)
         self.controller.select_coordinate(current_contact.center, False, False)
 
     def set_contact_label(self, label):
         self.contact_name.setText(label)
 
     def set_lead_location(self, x, y):
-        self.x_lead_loc.setText(str(x))
-        self.y_lead_loc.setText(str(y))
+        # Fill in both fields before telling the controller, so it is updated once with the new x and y
+        for line_edit, value in ((self.x_lead_loc, x), (self.y_lead_loc, y)):
+            line_edit.blockSignals(True)
+            line_edit.setText(str(value))
+            line_edit.blockSignals(False)
+        self.apply_lead_location()
 
     def update_lead_dims(self,x,y):
         self.x_loc_max.setText('/%s'%x)
         self.y_loc_max.setText('/%s'%y)
 
     def lead_location_changed(self):
-        x = self.find_digit(self.x_lead_loc.text())
-        self.x_lead_loc.setText(x)
-        y = self.find_digit(self.y_lead_loc.text())
-        self.y_lead_loc.setText(y)
-        group = self.find_digit(self.lead_group.text())
-        self.lead_group.setText(group)
+        self.apply_lead_location()
+
+    def apply_lead_location(self):
+        values = []
+        for line_edit in (self.x_lead_loc, self.y_lead_loc, self.lead_group):
+            digits = self.find_digit(line_edit.text())
+            if digits != line_edit.text():
+                # Writing back the cleaned text should not schedule another update
+                line_edit.blockSignals(True)
+                line_edit.setText(digits)
+                line_edit.blockSignals(False)
+            values.append(digits)
+        x, y, group = values
 
         if len(x) > 0 and len(y) > 0 and len(group) > 0:
             self.controller.set_lead_location([int(x), int(y)], int(group))
 
     @staticmethod
     def find_digit(label):
-        return re.sub(r"[^\d]", "", str(label))
+        # isdecimal matches the same characters as \d, all of which int() accepts
+        return ''.join(c for c in str(label) if c.isdecimal())
 
     def lead_changed(self):
         lead_txt = self.label_dropdown.currentText()
         if(lead_txt == ''):
             return # No leads to select
         self.controller.set_selected_lead(lead_txt.split()[0])
+        self.lead_group.blockSignals(True)
         self.lead_group.setText("0")
-        self.lead_location_changed()
+        self.lead_group.blockSignals(False)
+        self.apply_lead_location()
 
     def contact_changed(self):
         self.controller.set_contact_label(self.contact_name.text())
@@ -670,19 +738,54 @@ class ContactPanelWidget(QtGui.QWidget):
         self.controller.add_selection()
 
     def set_chosen_leads(self, leads):
-        self.contact_list.clear()
-        self.contacts = []
+        """
+        Shows the contacts of the given leads, reusing the existing list items.
+        Only rows whose text changed are rewritten; items are only created or removed when the count changes.
+        :param leads: Dictionary of lead label to Lead
+        """
+        contacts = []
         for lead_name in sorted(leads.keys()):
             lead = leads[lead_name]
-            for contact_name in sorted(lead.contacts.keys(), key=lambda x: int(''.join(re.findall('\d+', x)))):
-                contact = lead.contacts[contact_name]
-                self.add_contact(lead, contact)
+            for contact_name in sorted(lead.contacts.keys(), key=_contact_sort_key):
+                contacts.append((lead, lead.contacts[contact_name]))
+        texts = [self.contact_text(lead, contact) for (lead, contact) in contacts]
+
+        contact_list = self.contact_list
+        contact_list.setUpdatesEnabled(False)
+        contact_list.blockSignals(True)
+        contact_list.clearSelection()
+        contact_list.setCurrentItem(None)
+        set_list_texts(contact_list, texts)
+        contact_list.blockSignals(False)
+        contact_list.setUpdatesEnabled(True)
+
+        self.contacts = contacts
+        self._contact_bounds = None
+
+    def contact_text(self, lead, contact):
+        return self.config['lead_display'].format(lead=lead, contact=contact).strip()
 
     def add_contact(self, lead, contact):
-        self.contact_list.addItem(
-            QtGui.QListWidgetItem(self.config['lead_display'].format(lead=lead, contact=contact).strip())
-        )
+        self.contact_list.addItem(QtGui.QListWidgetItem(self.contact_text(lead, contact)))
         self.contacts.append((lead, contact))
+        self._contact_bounds = None
+
+    def contact_index(self, coordinate):
+        """
+        Finds the first listed contact containing a coordinate, checking all contacts at once
+        :param coordinate: The point in voxel space
+        :return: The row of the contact in the contact list, or None if no contact contains it
+        """
+        if self._contact_bounds is None:
+            # Micro-contacts have no points and never contain a coordinate
+            self._contact_bounds = np.array([np.full((2, 3), np.nan) if isinstance(contact, MicroContact)
+                                             else contact.point_mask.bounds
+                                             for _, contact in self.contacts], float).reshape(-1, 2, 3)
+        offsets = np.asarray(coordinate, float) - self._contact_bounds
+        # Same tolerance as PointMask.__contains__
+        inside = ((offsets[:, 0] > -1.5) & (offsets[:, 1] < 1.5)).all(1)
+        hits = np.flatnonzero(inside)
+        return int(hits[0]) if len(hits) > 0 else None
 
     def update_contacts(self):
         """
@@ -698,10 +801,24 @@ class ContactPanelWidget(QtGui.QWidget):
             self.set_lead_labels(labels)
 
     def set_lead_labels(self, lead_labels):
-        # Clear the dropdown, and disable the update callback here
-        self.label_dropdown.clear()
-        for lead_name in lead_labels:
-            self.label_dropdown.addItem(lead_name)
+        """
+        Makes the dropdown list lead_labels, only inserting and removing the entries that differ.
+        The current lead stays selected if it is still listed.
+        :param lead_labels: The dropdown entries, in order
+        """
+        dropdown = self.label_dropdown
+        keep = set(lead_labels)
+        for i in reversed(range(dropdown.count())):
+            if dropdown.itemText(i) not in keep:
+                dropdown.removeItem(i)
+        for i, lead_name in enumerate(lead_labels):
+            if i >= dropdown.count():
+                dropdown.addItems(list(lead_labels[i:]))
+                break
+            if dropdown.itemText(i) != lead_name:
+                dropdown.insertItem(i, lead_name)
+        while dropdown.count() > len(lead_labels):
+            dropdown.removeItem(dropdown.count() - 1)
 
 
 class LeadDefinitionWidget(QtGui.QWidget):
@@ -732,28 +849,33 @@ class LeadDefinitionWidget(QtGui.QWidget):
         self.close_button = QtGui.QPushButton("Confirm")
 
         self.leads_list = QtGui.QListWidget()
+        self.leads_list.setUniformItemSizes(True)
 
         self.add_callbacks()
         self.set_layout()
         self.set_tab_order()
         self.set_shortcuts()
-        self._leads = OrderedDict()
+        self._leads = {}
+        self._last_refresh_key = None
 
     def set_layout(self):
         layout = QtGui.QVBoxLayout(self)
-        add_labeled_widget(layout,
-                                "Lead Name: ", self.label_edit)
 
-        size_layout = QtGui.QHBoxLayout()
-        size_layout.addWidget(QtGui.QLabel("Dimensions: "))
-        add_labeled_widget(size_layout, "x:", self.x_size_edit)
-        add_labeled_widget(size_layout, "y:", self.y_size_edit)
+        # One form for the labeled fields instead of a nested layout per field
+        form = QtGui.QFormLayout()
+        form.addRow("Lead Name: ", self.label_edit)
 
-        layout.addLayout(size_layout)
+        size_layout = QtGui.QHBoxLayout()
+        size_layout.addWidget(QtGui.QLabel("x:"))
+        size_layout.addWidget(self.x_size_edit)
+        size_layout.addWidget(QtGui.QLabel("y:"))
+        size_layout.addWidget(self.y_size_edit)
+        form.addRow("Dimensions: ", size_layout)
 
-        add_labeled_widget(layout, "Type: ", self.type_box)
+        form.addRow("Type: ", self.type_box)
+        form.addRow("Micro-contacts: ", self.micro_box)
+        layout.addLayout(form)
 
-        add_labeled_widget(layout,"Micro-contacts: ",self.micro_box)
         layout.addWidget(self.submit_button)
         layout.addWidget(self.leads_list)
 
@@ -801,35 +923,50 @@ class LeadDefinitionWidget(QtGui.QWidget):
         return window
 
     def finish(self):
-        leads = self._leads.values()
-        labels = [lead['label'] for lead in leads]
-        types = [lead['type'] for lead in leads]
-        dimensions = [(lead['x'], lead['y']) for lead in leads]
-        spacings = [self.config['lead_types'][lead_type]['spacing'] for lead_type in types]
-        radii = [self.config['lead_types'][lead_type]['radius'] for lead_type in types]
-        micros = [self.config['micros'][str(l.get('micro',' None'))] for l in leads]
+        lead_types = self.config['lead_types']
+        micro_types = self.config['micros']
+        labels, types, dimensions, spacings, radii, micros = [], [], [], [], [], []
+        for lead in self._leads.values():
+            lead_type = lead_types[lead['type']]
+            labels.append(lead['label'])
+            types.append(lead['type'])
+            dimensions.append((lead['x'], lead['y']))
+            spacings.append(lead_type['spacing'])
+            radii.append(lead_type['radius'])
+            micros.append(micro_types[str(lead.get('micro', ' None'))])
         self.controller.set_leads(labels, types, dimensions, radii, spacings,micros)
         self.close()
         self.controller.lead_window.close()
 
     def set_leads(self, leads):
-        self._leads = {lead.label:
-                       {"label": lead.label,
-                        "x":lead.dimensions[0],
-                        "y":lead.dimensions[1],
-                        "type":lead.type_,
-                        "micro":lead.micros['name']}
-                      for lead in leads.values() }
+        lead_dicts = {}
+        for lead in leads.values():
+            label = lead.label
+            dimensions = lead.dimensions
+            lead_dicts[label] = {"label": label,
+                                 "x": dimensions[0],
+                                 "y": dimensions[1],
+                                 "type": lead.type_,
+                                 "micro": lead.micros['name']}
+        self._leads = lead_dicts
         self.refresh()
 
     def refresh(self):
-        self.leads_list.clear()
-        for lead in self._leads.values():
-            self.leads_list.addItem(
-                QtGui.QListWidgetItem(
-                    "{label} ({x} x {y}, {type})".format(**lead)
-                )
-            )
+        # Nothing to do if the leads are the same as when the list was last filled
+        key = tuple((lead['label'], lead['x'], lead['y'], lead['type'], lead.get('micro'))
+                    for lead in self._leads.values())
+        if key == self._last_refresh_key:
+            return
+        self._last_refresh_key = key
+        leads_list = self.leads_list
+        leads_list.setUpdatesEnabled(False)
+        # Rows are relabelled in place, so drop the current item rather than leave it on a different lead
+        leads_list.blockSignals(True)
+        leads_list.clearSelection()
+        leads_list.setCurrentItem(None)
+        set_list_texts(leads_list, ["{label} ({x} x {y}, {type})".format(**lead) for lead in self._leads.values()])
+        leads_list.blockSignals(False)
+        leads_list.setUpdatesEnabled(True)
 
     def add_current_lead(self):
         x_str = str(self.x_size_edit.text())
@@ -858,14 +995,6 @@ class LeadDefinitionWidget(QtGui.QWidget):
             del self._leads[label]
             self.refresh()
 
-    @staticmethod
-    def add_labeled_widget(layout, label, widget):
-        sub_layout = QtGui.QHBoxLayout()
-        label_widget = QtGui.QLabel(label)
-        sub_layout.addWidget(label_widget)
-        sub_layout.addWidget(widget)
-        layout.addLayout(sub_layout)
-
 class ThresholdWidget(QtGui.QWidget):
     """
     Subwindow for changing the threshold
@@ -878,19 +1007,32 @@ class ThresholdWidget(QtGui.QWidget):
         
         self.set_threshold_button = QtGui.QPushButton("Update")
         self.set_threshold_button.clicked.connect(self.update_pressed)
+        # Rethresholding rebuilds every cloud, so presses in quick succession are applied once
+        self._threshold_timer = QtCore.QTimer(self)
+        self._threshold_timer.setSingleShot(True)
+        self._threshold_timer.setInterval(100)
+        self._threshold_timer.timeout.connect(self.apply_threshold)
         self.threshold_selector = QtGui.QDoubleSpinBox()
         self.threshold_selector.setSingleStep(0.5)
         self.threshold_selector.setValue(self.config['ct_threshold'])
         self.threshold_selector.valueChanged.connect(self.update_threshold_value)
-        self.threshold_selector.setKeyboardTracking(True)
+        self.threshold_selector.setKeyboardTracking(False)
 
-        layout = QtGui.QVBoxLayout(self)
+        layout = QtGui.QFormLayout(self)
         layout.setContentsMargins(1,1,1,1)
-        add_labeled_widget(layout,'CT Threshold',self.threshold_selector,self.set_threshold_button)
+        threshold_layout = QtGui.QHBoxLayout()
+        threshold_layout.addWidget(self.threshold_selector)
+        threshold_layout.addWidget(self.set_threshold_button)
+        layout.addRow('CT Threshold', threshold_layout)
 
         self.setSizePolicy(QtGui.QSizePolicy.Preferred,QtGui.QSizePolicy.Maximum)
 
     def update_pressed(self):
+        # Commit any typed value; the button does not take focus from the spin box on every platform
+        self.threshold_selector.interpretText()
+        self._threshold_timer.start()
+
+    def apply_threshold(self):
         if self.controller.ct:
             self.controller.ct.set_threshold(self.config['ct_threshold'])
             for label in ['_ct','_leads','_selected']:
@@ -949,8 +1091,11 @@ class CloudWidget(QtGui.QWidget):
     def update_cloud(self, label):
         self.viewer.update_cloud(label)
 
+    def update_clouds(self, labels):
+        self.viewer.update_clouds(labels)
+
     def add_cloud(self, ct, label, callback=None):
-        log.debug("CloudWidget.add_cloud: Adding cloud {} to view".format(label))
+        log.debug("CloudWidget.add_cloud: Adding cloud %s to view", label)
         self.viewer.add_cloud(ct, label, callback)
 
     def add_RAS(self,ct,callback=None):
@@ -993,9 +1138,25 @@ class CloudViewer(HasTraits):
         self.RAS = None
 
     def update_cloud(self, label):
-        if self.clouds:
+        # The cloud may have been removed since the update was requested
+        if label in self.clouds:
             self.clouds[label].update()
 
+    def update_clouds(self, labels):
+        """
+        Updates several clouds, rendering the scene once at the end rather than once per cloud
+        :param labels: Labels of the clouds to update
+        """
+        scene = self.figure.scene
+        render_was_disabled = scene.disable_render
+        scene.disable_render = True
+        try:
+            for label in labels:
+                self.update_cloud(label)
+        finally:
+            # Re-enabling rendering renders the scene, unless an outer batch still holds it off
+            scene.disable_render = render_was_disabled
+
     def plot_cloud(self,label):
         self.clouds[label].plot()
 
@@ -1003,15 +1164,15 @@ class CloudViewer(HasTraits):
         self.clouds[label].unplot()
 
     def add_cloud(self, ct, label, callback=None):
-        log.debug("CloudViewer.add_cloud: Adding cloud {} to view".format(label))
+        log.debug("CloudViewer.add_cloud: Adding cloud %s to view", label)
         if label in self.clouds:
-            log.debug("CloudViewer.add_cloud: Cloud {} already exists, removing...".format(label))
+            log.debug("CloudViewer.add_cloud: Cloud %s already exists, removing...", label)
             self.remove_cloud(label)
         self.clouds[label] = CloudView(ct, label, self.config, callback)
         self.clouds[label].plot()
 
     def add_RAS(self,ct,callback=None):
-        self.RAS = AxisView(ct,self.config,callback)
+        self.RAS = AxisView(ct,self.config,callback,figure=self.figure)
         self.RAS.plot()
 
     def switch_RAS_LAS(self):
@@ -1076,36 +1237,55 @@ class CloudView(object):
         log.debug("CloudView.__init__: Setting plot and glyph to None")
         self._plot = None
         self._glyph_points = None
+        self._shown = None #: The (labels, x, y, z) currently drawn
         log.debug("CloudView.__init__: Done")
 
     def callback(self, picker):
         return self._callback(np.array(picker.pick_position))
 
     def get_colors(self, labels, x, y, z):
-        colors = np.ones(len(x))
         if len(labels) == 0:
             return []
-        min_y = float(min(y))
-        max_y = float(max(y))
-        for i, label in enumerate(labels):
-            if label == '_ct':
-                colors[i] = ((y[i] - min_y) / max_y) * \
+        # Every point with the same label gets the same color, except CT points which are shaded by y
+        if labels.count(labels[0]) == len(labels):
+            # The CT and selection clouds only ever have one label; no need to sort them
+            unique_labels, inverse = np.array([labels[0]]), np.zeros(len(labels), int)
+        else:
+            unique_labels, inverse = np.unique(labels, return_inverse=True)
+        label_colors = np.zeros(len(unique_labels), np.float32)
+        for i, label in enumerate(unique_labels):
+            if label == '_selected':
+                label_colors[i] = .2
+            elif label != '_ct':
+                label_colors[i] = _lead_shade(str(label)) * \
+                                  (self.config['lead_max_color'] - self.config['lead_min_color']) \
+                                  + self.config['lead_min_color']
+        colors = label_colors[inverse]
+
+        ct_index = np.flatnonzero(unique_labels == '_ct')
+        if len(ct_index) > 0:
+            is_ct = inverse == ct_index[0]
+            min_y = float(y.min())
+            max_y = float(y.max())
+            colors[is_ct] = ((y[is_ct] - min_y) / max_y) * \
                             (self.config['ct_max_color'] - self.config['ct_min_color']) \
                             + self.config['ct_min_color']
-            elif label == '_selected':
-                colors[i] = .2
-            else:
-                seeded_rand = random.Random(label)
-                colors[i] = seeded_rand.random() * \
-                            (self.config['lead_max_color'] - self.config['lead_min_color']) \
-                            + self.config['lead_min_color']
         return colors
 
     def contains(self, picker):
         return True if self._plot else False  # and picker.pick_position in self.ct.xyz(self.label)
 
-    def plot(self):
+    def get_xyz(self):
+        """
+        Gets the labels and coordinates of the cloud's points
+        :return: labels, and x, y, z as contiguous float32 arrays so VTK does not convert them on every update
+        """
         labels, x, y, z = self.ct.xyz(self.label)
+        x, y, z = [np.ascontiguousarray(c, np.float32) for c in (x, y, z)]
+        return labels, x, y, z
+
+    def plot(self):
+        labels, x, y, z = self.get_xyz()
         self._plot = mlab.points3d(x, y, z,  # self.get_colors(labels, x, y, z),
                                    mode='cube', resolution=3,
                                    colormap=self.colormap,
@@ -1114,31 +1294,46 @@ class CloudView(object):
                                    scale_mode='none', scale_factor=1
                                    )
         self._plot.mlab_source.set(scalars=self.get_colors(labels, x, y, z))
+        self._shown = (labels, x, y, z)
 
     def unplot(self):
         self._plot.mlab_source.reset(x=[], y=[], z=[], scalars=[])
-    '''
-    def update(self):
-        labels, x, y, z = self.ct.xyz(self.label)
-        log.debug("Updating cloud {} with {} points".format(self.label, len(labels)))
-        self._plot.mlab_source.reset(
-            x=x, y=y, z=z, scalars=self.get_colors(labels, x, y, z))
-    '''
-    def update(self):
-        labels, x, y, z = self.ct.xyz(self.label)
-        # Ensure x, y, z, and colors are numpy arrays of a compatible type, e.g., np.float32
+        self._shown = None
+
+    def is_shown(self, labels, x, y, z):
+        """
+        Checks whether these points and labels are exactly the ones already drawn
+        """
+        if self._shown is None:
+            return False
+        shown_labels, shown_x, shown_y, shown_z = self._shown
+        return len(x) == len(shown_x) and \
+               np.array_equal(x, shown_x) and np.array_equal(y, shown_y) and np.array_equal(z, shown_z) and \
+               list(labels) == list(shown_labels)
 
-        log.debug("Updating cloud {} with {} points".format(self.label, len(labels)))
-        #self._plot.mlab_source.set(x=x, y=y, z=z, scalars=self.get_colors(labels, x, y, z))    
-#        self._plot.mlab_source.reset(x=x, y=y, z=z, scalars=self.get_colors(labels, x, y, z))
+    def update(self):
+        labels, x, y, z = self.get_xyz()
+        if self.is_shown(labels, x, y, z):
+            # e.g. the selection after rethresholding when nothing was selected
+            log.debug("Cloud %s is unchanged", self.label)
+            return
+        self._shown = (labels, x, y, z)
+        log.debug("Updating cloud %s with %s points", self.label, len(labels))
+        if len(x) > 0 and len(x) == len(self._plot.mlab_source.x):
+            # Same number of points: refill the existing VTK arrays instead of building a new pipeline.
+            # This also leaves the camera alone.
+            self._plot.mlab_source.set(x=x, y=y, z=z, scalars=self.get_colors(labels, x, y, z))
+            return
 
+        # The point count changed, which the existing glyph source cannot take in place
         #Save camera settings
         position = self._plot.scene.camera.position
         focal_point = self._plot.scene.camera.focal_point
         view_angle = self._plot.scene.camera.view_angle
         clipping_range = self._plot.scene.camera.clipping_range
         parallel_scale = self._plot.scene.camera.parallel_scale
-        #Disable rendering
+        #Disable rendering, unless the caller already has (e.g. CloudViewer.update_clouds)
+        render_was_disabled = self._plot.scene.disable_render
         self._plot.scene.disable_render = True
         # Delete old plot
         self._plot.remove()
@@ -1158,7 +1353,7 @@ class CloudView(object):
         self._plot.scene.camera.clipping_range = clipping_range
         self._plot.scene.camera.parallel_scale = parallel_scale
         #Re-enable rendering
-        self._plot.scene.disable_render = False
+        self._plot.scene.disable_render = render_was_disabled
         # Force a render
         self._plot.mlab_source.set(scalars=self.get_colors(labels, x, y, z))
         self._plot.scene.render()
@@ -1173,27 +1368,34 @@ class CloudView(object):
 
 class AxisView(CloudView):
 
-    def __init__(self,ct,config,callback=None):
+    def __init__(self,ct,config,callback=None,figure=None):
         super(AxisView, self).__init__(ct,config=config,label='Axis',callback=callback)
         self.scale = 35
         self._plots = []
+        self.figure = figure #: The figure the letters are drawn in; the current figure if None
 
     def plot(self):
         coords = self.ct._points.coordinates
-        center = np.array([0.5*(coords[:,i].max() + coords[:,i].min()) for i in range(3)])
+        center = 0.5*(coords.max(0) + coords.min(0))
         u,v,w,t = self.ct.affine.T
         max_dist = np.abs(coords-center).max()
         # axis = [1, 0 , 0] this refers to R and L labeling.
         # axis = [0, 1, 0] this refers to A and P labeling.
         # axis = [0, 0, 1] this refers to S and I labeling.
+        # Draw all six letters with rendering held off, then render once
+        figure = self.figure if self.figure is not None else mlab.gcf()
+        scene = figure.scene
+        render_was_disabled = scene.disable_render
+        scene.disable_render = True
         try:
             name_pair_list = [['R','L'],['A','P'],['S','I']]
             if (self.ct.coordSystem == 'LAS'):
                 # Swap the order of R and L
                 name_pair_list[0] = ['L', 'R']
-            u = np.int32(np.sign(u))
-            v = np.int32(np.sign(v))
-            w = np.int32(np.sign(w))
+            # Signs of the three direction columns, with rounding noise treated as zero
+            uvw = np.stack([u, v, w])
+            signs = np.where(np.abs(uvw) < 1e-4, 0, np.sign(uvw)).astype(np.int32)
+            u, v, w = signs
             for i, axis in enumerate(zip((u,v,w))):
                 # axis is a 3-tuple, find the index of the element which is closest to 1 (or -1)
                 axis = axis[0] # tuple to list
@@ -1213,15 +1415,17 @@ class AxisView(CloudView):
                     color = [0.,0.,0.]
                     color[i] = 1.
                     letter = mlab.text3d(location[0], location[1], location[2], name, color=tuple(color), scale=self.scale,
-                                         opacity=0.75,
+                                         opacity=0.75, figure=figure,
                                          )
                     self._plots.append(letter)
         except TypeError as e:
-            log.error("Could not plot RAS axes: {}".format(e))
+            log.error("Could not plot RAS axes: %s", e)
         except IndexError as e:
-            log.error("Could not plot RAS axes: {}".format(e))
+            log.error("Could not plot RAS axes: %s", e)
         except AssertionError as e:
-            log.error("Could not plot RAS axes: {}".format(e))
+            log.error("Could not plot RAS axes: %s", e)
+        finally:
+            scene.disable_render = render_was_disabled
 
     def contains(self, picker):
         return False
@@ -1249,7 +1453,7 @@ class AxisView(CloudView):
 if __name__ == '__main__':
     # controller = PylocControl(yaml.load(open(os.path.join(os.path.dirname(__file__) , "../config.yml"))))
     #controller = PylocControl()
-    controller = PylocControl(yaml.load(open(os.path.join(os.path.dirname(__file__), "../config.yml"))))
+    controller = PylocControl(load_config(os.path.join(os.path.dirname(__file__), "../config.yml")))
 
     # controller.load_ct("../T01_R1248P_CT.nii.gz")
     # controller.load_ct('/Volumes/rhino_mount/data10/RAM/subjects/R1226D/tal/images/combined/R1226D_CT_combined.nii.gz')
@@ -1263,7 +1467,7 @@ if __name__ == '__main__':
 
 if __name__ == 'x__main__':
     app = QtGui.QApplication.instance()
-    x = LeadDefinitionWidget(None, yaml.load(open(os.path.join(os.path.dirname(__file__), "../model/config.yml"))))
+    x = LeadDefinitionWidget(None, load_config(os.path.join(os.path.dirname(__file__), "../config.yml")))
     x.show()
     window = QtGui.QMainWindow()
     window.setCentralWidget(x)
@@ -1,15 +1,9 @@
 __author__ = 'iped'
 
-from traits.api import HasTraits, Instance, on_trait_change
-from traitsui.api import View, Item
-from mayavi.core.ui.api import MayaviScene, MlabSceneModel, \
-        SceneEditor
-from mayavi import mlab
 from pyface.qt import QtGui, QtCore
-import matplotlib.pyplot as plt
-
 from matplotlib.backends.backend_qtagg  import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
+from matplotlib.patches import Circle
 
 import numpy as np
 
@@ -55,8 +49,6 @@ class SliceViewWidget(QtGui.QWidget):
 
 class SliceView(FigureCanvas):
 
-    scene = Instance(MlabSceneModel, ())
-
     def __init__(self, parent=None, image=None, axis=None, subplot=1):
         self.fig = Figure(facecolor='black')
         self.axes = self.fig.add_subplot(1, 1, 1)
@@ -102,8 +94,7 @@ class SliceView(FigureCanvas):
         self.axes.set_xticklabels([])
         self.axes.set_yticklabels([])
         self.axes.set_facecolor((0,0,0))
-        self._plot = self.axes.imshow(plotted_image, cmap=plt.get_cmap('bone'))
-        plt.axis('off')
+        self._plot = self.axes.imshow(plotted_image, cmap='bone')
         circl_coords = list(self.coordinate)
         del circl_coords[self.axis]
         radius = 10 if self.axis != 3 else 40
@@ -113,7 +104,7 @@ class SliceView(FigureCanvas):
         else:
             circl_coords[1] = plotted_image.shape[0] - circl_coords[1]
 
-        self.circ = plt.Circle(circl_coords, radius=radius, edgecolor='r', fill=False)
+        self.circ = Circle(circl_coords, radius=radius, edgecolor='r', fill=False)
         self.axes.add_patch(self.circ)
         #plt.tight_layout()
         #self._plot = plt.imshow(self.image[plot_plane], colormap='bone')#, aspect='auto')